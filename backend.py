@@ -1,100 +1,471 @@
 # backend.py
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple, Callable
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from contextlib import asynccontextmanager
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager, nullcontext
 import uvicorn
 import asyncio
 import threading
 from queue import Queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import atexit
 import sys
-import traceback
+import random
+import subprocess
+
+import numpy as np
+import orjson
+from cachetools import TTLCache
+import redis.asyncio as redis
 
 from langchain_google_genai import ChatGoogleGenerativeAI
+from sentence_transformers import SentenceTransformer
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain.memory import ChatMessageHistory
-from langsmith import traceable
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langsmith import traceable, tracing_context
+
+# Enhanced logging configuration; records are formatted by the QueueHandler and
+# written to stdout/file by a listener thread, keeping I/O off the event loop
+log_queue = Queue(-1)
+log_listener = QueueListener(
+    log_queue,
+    logging.StreamHandler(sys.stdout),
+    logging.FileHandler('chatbot_backend.log')
+)
+log_listener.start()
+atexit.register(log_listener.stop)
 
-# Enhanced logging configuration
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('chatbot_backend.log')
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
+# With LANGCHAIN_TRACING_V2 on, only a sampled fraction of requests is traced
+TRACE_SAMPLE_RATE = float(os.getenv("CHATBOT_TRACE_SAMPLE_RATE", "0.1"))
+
+def sampled_tracing():
+    """Leave tracing as configured for sampled requests and turn it off for the rest"""
+    if random.random() < TRACE_SAMPLE_RATE:
+        return nullcontext()
+    return tracing_context(enabled=False)
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
     session_id: str
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str
 
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """GZip responses except the token stream, which must reach the client chunk by chunk"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/chat/stream":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+class CompactChatHistory(BaseChatMessageHistory):
+    """Windowed chat history stored as parallel role/content lists, plus a running summary of older turns"""
+    HUMAN, AI, SYSTEM = 0, 1, 2
+    _MESSAGE_TYPES = {HUMAN: HumanMessage, AI: AIMessage, SYSTEM: SystemMessage}
+
+    def __init__(self, max_turns: int = 8, evict_turns: int = 4):
+        self.max_turns = max_turns
+        # Turns folded into the summary at once, so summarization runs every `evict_turns` turns
+        self.evict_turns = evict_turns
+        self.roles: List[int] = []
+        self.contents: List[str] = []
+        self.summary = ""
+        # Messages pushed out of the window that have not been folded into the summary yet
+        self.evicted: List[BaseMessage] = []
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Rebuild message objects for the window only when LangChain asks for them"""
+        return [self._MESSAGE_TYPES[role](content=content) for role, content in zip(self.roles, self.contents)]
+
+    @property
+    def summary_context(self) -> str:
+        """Summary text to append to the system prompt"""
+        if not self.summary:
+            return ""
+        return f"\n\nSummary of the earlier conversation: {self.summary}"
+
+    @property
+    def is_new(self) -> bool:
+        """True before the first turn, when a reply cannot depend on earlier context"""
+        return not self.roles and not self.summary and not self.evicted
+
+    @classmethod
+    def _role_of(cls, message: BaseMessage) -> int:
+        # Streamed replies arrive as AIMessageChunk, a subclass of AIMessage
+        if isinstance(message, AIMessage):
+            return cls.AI
+        if isinstance(message, HumanMessage):
+            return cls.HUMAN
+        if isinstance(message, SystemMessage):
+            return cls.SYSTEM
+        raise ValueError(f"Unsupported message type: {message.type}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable state, used to share sessions through Redis"""
+        return {
+            "roles": self.roles,
+            "contents": self.contents,
+            "summary": self.summary,
+            "evicted": [[self._role_of(message), message.content] for message in self.evicted]
+        }
+
+    def load_dict(self, state: Dict[str, Any]) -> None:
+        """Replace this history's state with one produced by to_dict"""
+        self.roles = state["roles"]
+        self.contents = state["contents"]
+        self.summary = state["summary"]
+        self.evicted = [self._MESSAGE_TYPES[role](content=content) for role, content in state["evicted"]]
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.roles.append(self._role_of(message))
+        self.contents.append(message.content)
+
+        overflow = len(self.roles) - 2 * self.max_turns
+        if overflow > 0:
+            overflow = max(overflow, 2 * self.evict_turns)
+            self.evicted.extend(
+                self._MESSAGE_TYPES[role](content=content)
+                for role, content in zip(self.roles[:overflow], self.contents[:overflow])
+            )
+            del self.roles[:overflow]
+            del self.contents[:overflow]
+
+    def clear(self) -> None:
+        self.roles = []
+        self.contents = []
+        self.summary = ""
+        self.evicted = []
+
+class SessionStore:
+    """Bounded in-process session store; sessions idle for `ttl` seconds are evicted"""
+    def __init__(self, ttl: int = 3600, maxsize: int = 10_000):
+        self.ttl = ttl
+        # One history object per session within a worker, so the chain's history
+        # getter and get_response see the same instance
+        self.sessions: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def local(self, session_id: str) -> Optional[CompactChatHistory]:
+        """This worker's copy of the session's history, without any I/O"""
+        return self.sessions.get(session_id)
+
+    async def load(self, session_id: str) -> CompactChatHistory:
+        """Get or create the session's history, refreshing its idle timeout"""
+        history = self.sessions.get(session_id)
+        if history is None:
+            logger.debug("Creating new chat history for session %s", session_id)
+            history = CompactChatHistory()
+        # Re-inserting refreshes the session's idle timeout
+        self.sessions[session_id] = history
+        return history
+
+    async def save(self, session_id: str, history: CompactChatHistory):
+        """Persist the history unless the session was deleted in the meantime"""
+        # Turns are added to the stored object itself, and a deleted session's
+        # object is simply dropped, so there is nothing to write back
+
+    async def update(self, session_id: str, apply: Callable[[CompactChatHistory], Any]) -> Any:
+        """Apply a change to the session's current history and persist it; None if the session is gone"""
+        history = self.sessions.get(session_id)
+        if history is None:
+            return None
+        return apply(history)
+
+    async def delete(self, session_id: str) -> bool:
+        """Remove the session, returning whether it existed"""
+        return self.sessions.pop(session_id, None) is not None
+
+    async def close(self):
+        self.sessions.clear()
+
+class RedisSessionStore(SessionStore):
+    """Session histories shared across worker processes through Redis"""
+    def __init__(self, url: str, ttl: int = 3600, prefix: str = "chatbot:session:"):
+        super().__init__(ttl)
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    async def load(self, session_id: str) -> CompactChatHistory:
+        key = self.prefix + session_id
+        # Read the session and refresh its idle timeout in one round trip
+        data = await self.redis.getex(key, ex=self.ttl)
+        if data is None:
+            logger.debug("Creating new chat history for session %s", session_id)
+            history = CompactChatHistory()
+            await self.redis.set(key, orjson.dumps(history.to_dict()), ex=self.ttl, nx=True)
+        else:
+            history = self.sessions.get(session_id) or CompactChatHistory()
+            history.load_dict(orjson.loads(data))
+        self.sessions[session_id] = history
+        return history
+
+    async def save(self, session_id: str, history: CompactChatHistory):
+        # XX only overwrites an existing key, so a turn finishing after a DELETE
+        # doesn't bring the session back
+        if not await self.redis.set(self.prefix + session_id, orjson.dumps(history.to_dict()), ex=self.ttl, xx=True):
+            self.sessions.pop(session_id, None)
+
+    async def update(self, session_id: str, apply: Callable[[CompactChatHistory], Any]) -> Any:
+        # Re-read and write under WATCH, so turns other workers saved since this
+        # worker's copy was loaded are kept rather than overwritten
+        key = self.prefix + session_id
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    data = await pipe.get(key)
+                    if data is None:
+                        self.sessions.pop(session_id, None)
+                        return None
+                    history = CompactChatHistory()
+                    history.load_dict(orjson.loads(data))
+                    result = apply(history)
+                    pipe.multi()
+                    pipe.set(key, orjson.dumps(history.to_dict()), ex=self.ttl)
+                    await pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        # Refresh the local copy in place; in-flight requests hold a reference to it
+        local = self.sessions.get(session_id)
+        if local is not None:
+            local.load_dict(history.to_dict())
+        return result
+
+    async def delete(self, session_id: str) -> bool:
+        self.sessions.pop(session_id, None)
+        return bool(await self.redis.delete(self.prefix + session_id))
+
+    async def close(self):
+        # Shared sessions outlive any single worker; only the local copies are dropped
+        self.sessions.clear()
+        await self.redis.aclose()
+
+class SemanticCache:
+    """Replies to conversation-opening prompts, shared by every session and keyed on prompt embeddings"""
+    def __init__(self, model: SentenceTransformer, threshold: float = 0.95, maxsize: int = 1024):
+        self.model = model
+        self.threshold = threshold
+        # Ring buffer of unit-norm prompt embeddings and their responses; once it
+        # is full, each new entry overwrites the oldest one
+        self.embeddings = np.zeros((maxsize, model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self.responses: List[str] = []
+        self.next = 0
+
+    @staticmethod
+    def _normalize(message: str) -> str:
+        return " ".join(message.lower().split())
+
+    async def embed(self, message: str) -> np.ndarray:
+        """Embed the normalized prompt as a unit vector with the local model"""
+        vector = await asyncio.to_thread(self.model.encode, self._normalize(message), normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[str]:
+        """Return the cached response of the most similar past prompt above the threshold"""
+        if not self.responses:
+            return None
+        scores = self.embeddings[:len(self.responses)] @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self.responses[best]
+
+    def add(self, embedding: np.ndarray, response: str):
+        """Store a response for the given prompt embedding"""
+        if len(self.responses) < len(self.embeddings):
+            self.responses.append(response)
+        else:
+            self.responses[self.next] = response
+        self.embeddings[self.next] = embedding
+        self.next = (self.next + 1) % len(self.embeddings)
+
 class ChatbotState:
-    def __init__(self, llm, chain):
+    def __init__(self, llm, chain_with_history, summary_chain, cache: SemanticCache):
         self.llm = llm
-        self.chain = chain
+        self.chain_with_history = chain_with_history
+        self.summary_chain = summary_chain
+        self.cache = cache
+
+    async def _lookup_cache(self, message: str, history: CompactChatHistory) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """Embed an opening prompt and look up a cached response for it"""
+        # Only a conversation's opening prompt is answered without context, so only
+        # those replies can be reused, by any session
+        if not history.is_new:
+            return None, None
+        try:
+            embedding = await self.cache.embed(message)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed, falling back to LLM: %s", e)
+            return None, None
+        return embedding, self.cache.lookup(embedding)
+
+    @staticmethod
+    def _chain_config(session_id: str, metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # The request metadata is already a fresh dict per call, so tag it in place
+        if metadata is None:
+            metadata = {}
+        metadata.setdefault("session_id", session_id)
+        return {
+            "configurable": {"session_id": session_id},
+            "metadata": metadata
+        }
 
     @traceable(run_type="llm_chain")
-    async def get_response(self, message: str, session_id: str, chat_sessions: Dict[str, ChatMessageHistory], metadata: Optional[Dict[str, Any]] = None) -> str:
+    async def get_response(self, message: str, session_id: str, chat_sessions: SessionStore, metadata: Optional[Dict[str, Any]] = None) -> str:
         """Get response from the chatbot"""
         try:
-            logger.debug(f"Processing message for session {session_id}: {message}")
-            
-            # Get or create chat history for the session
-            if session_id not in chat_sessions:
-                logger.debug(f"Creating new chat history for session {session_id}")
-                chat_sessions[session_id] = ChatMessageHistory()
+            logger.debug("Processing message for session %s: %s", session_id, message)
+            history = await chat_sessions.load(session_id)
 
-            # Create chain with history
-            chain_with_history = RunnableWithMessageHistory(
-                self.chain,
-                lambda sid: chat_sessions[sid],
-                input_messages_key="input",
-                history_messages_key="history"
-            )
+            # Serve near-identical opening prompts from the semantic cache, skipping the LLM round trip
+            embedding, cached = await self._lookup_cache(message, history)
+            if cached is not None:
+                logger.debug("Semantic cache hit for session %s", session_id)
+                history.add_user_message(message)
+                history.add_ai_message(cached)
+                await chat_sessions.save(session_id, history)
+                return cached
 
             logger.debug("Sending request to LLM")
-            response = await chain_with_history.ainvoke(
-                {"input": message},
-                config={
-                    "configurable": {"session_id": session_id},
-                    "metadata": {
-                        "session_id": session_id,
-                        **(metadata or {})
-                    }
-                }
+            response = await self.chain_with_history.ainvoke(
+                {"input": message, "summary": history.summary_context},
+                config=self._chain_config(session_id, metadata)
             )
-            logger.debug(f"Received response from LLM: {response.content}")
+            logger.debug("Received response from LLM: %s", response.content)
+            # Persist the turn unless the session was cleared while the LLM was answering
+            await chat_sessions.save(session_id, history)
+            if embedding is not None:
+                self.cache.add(embedding, response.content)
             return response.content
 
         except Exception as e:
-            logger.error(f"Error in get_response: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.error("Error in get_response: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             raise HTTPException(status_code=500, detail=f"Chat processing error: {str(e)}")
 
+    @traceable(run_type="llm_chain")
+    async def stream_response(self, message: str, session_id: str, chat_sessions: SessionStore, metadata: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Stream the chatbot response as it is generated"""
+        logger.debug("Streaming message for session %s: %s", session_id, message)
+        history = await chat_sessions.load(session_id)
+
+        embedding, cached = await self._lookup_cache(message, history)
+        if cached is not None:
+            logger.debug("Semantic cache hit for session %s", session_id)
+            history.add_user_message(message)
+            history.add_ai_message(cached)
+            await chat_sessions.save(session_id, history)
+            yield cached
+            return
+
+        logger.debug("Streaming request to LLM")
+        chunks = []
+        async for chunk in self.chain_with_history.astream(
+            {"input": message, "summary": history.summary_context},
+            config=self._chain_config(session_id, metadata)
+        ):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield chunk.content
+        response = "".join(chunks)
+        logger.debug("Streamed response from LLM: %s", response)
+        await chat_sessions.save(session_id, history)
+        if embedding is not None:
+            self.cache.add(embedding, response)
+
+    async def warm_up(self):
+        """Open the Gemini connection and load the embedding model before the first user turn"""
+        try:
+            await asyncio.gather(
+                self.llm.ainvoke("ping"),
+                self.cache.embed("ping")
+            )
+            logger.info("LLM connections warmed up")
+        except Exception as e:
+            logger.warning("LLM warm-up failed: %s", e)
+
+    async def summarize_history(self, session_id: str, chat_sessions: SessionStore):
+        """Fold messages evicted from the history window into its running summary"""
+        history = chat_sessions.local(session_id)
+        if history is None or not history.evicted:
+            return
+
+        # Each step re-reads the stored history and changes only the summary and the
+        # evicted messages, so turns saved meanwhile, possibly by other workers, survive
+        def take_evicted(current: CompactChatHistory) -> Tuple[str, List[BaseMessage]]:
+            evicted, current.evicted = current.evicted, []
+            return current.summary, evicted
+
+        # Persist the hand-off so other workers don't summarize the same messages
+        taken = await chat_sessions.update(session_id, take_evicted)
+        if taken is None or not taken[1]:
+            return
+        summary, evicted = taken
+        try:
+            # Background tasks run after the request's sampling decision has been left
+            with sampled_tracing():
+                result = await self.summary_chain.ainvoke({
+                    "summary": summary or "(none)",
+                    "messages": evicted
+                })
+        except Exception as e:
+            logger.error("Error summarizing chat history: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+
+            def restore_evicted(current: CompactChatHistory):
+                # Keep the messages so the next summarization retries them
+                current.evicted = evicted + current.evicted
+
+            await chat_sessions.update(session_id, restore_evicted)
+            return
+
+        def set_summary(current: CompactChatHistory):
+            current.summary = result.content
+
+        await chat_sessions.update(session_id, set_summary)
+        logger.debug("Updated conversation summary: %s", result.content)
+
 class ChatbotBackend:
-    def __init__(self, api_port: int = 8000):
+    def __init__(self, api_port: int = 8000, workers: int = 1):
         """Initialize the chatbot backend"""
         self.api_port = api_port
-        self.response_queue = Queue()
+        self.workers = workers
         self.server_thread = None
-        self.chat_sessions: Dict[str, ChatMessageHistory] = {}
-        self.app = self._create_app()
-        
+        self.server_process: Optional[subprocess.Popen] = None
+        self.server: Optional[uvicorn.Server] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
         # Validate environment variables early
         self._validate_environment()
 
+        # Gunicorn workers each build their own session store and app through
+        # build_app(), so a supervising process needs neither
+        self.chat_sessions: Optional[SessionStore] = None
+        self.app: Optional[FastAPI] = None
+        if self.workers == 1:
+            # Bounded session store; sessions idle for an hour are evicted. Worker
+            # processes share sessions through Redis when REDIS_URL is set
+            redis_url = os.getenv("REDIS_URL")
+            self.chat_sessions = RedisSessionStore(redis_url) if redis_url else SessionStore()
+            self.app = self._create_app()
+
     def _validate_environment(self):
         """Validate required environment variables"""
         required_vars = {
@@ -108,13 +479,19 @@ class ChatbotBackend:
             logger.error(error_msg)
             raise ValueError(error_msg)
 
+        if self.workers > 1 and not os.getenv("REDIS_URL"):
+            error_msg = "REDIS_URL is required to share chat sessions across multiple workers"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
     def _create_app(self) -> FastAPI:
         """Create and configure FastAPI application"""
         app = FastAPI(
             title="Voice Chatbot API",
             description="API for voice-enabled chatbot with LangSmith tracing",
             version="1.0.0",
-            lifespan=self._lifespan
+            lifespan=self._lifespan,
+            default_response_class=ORJSONResponse
         )
 
         # Add CORS middleware
@@ -126,38 +503,71 @@ class ChatbotBackend:
             allow_headers=["*"],
         )
 
+        # Compress replies large enough to benefit; LLM prose shrinks well
+        app.add_middleware(StreamAwareGZipMiddleware, minimum_size=512)
+
         # Add routes
-        @app.post("/chat", response_model=ChatResponse)
-        @traceable(run_type="chain")
+        # ChatResponse documents the payload without re-validating it on every response
+        @app.post("/chat", responses={200: {"model": ChatResponse}})
         async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
             try:
-                logger.info(f"Received chat request for session {request.session_id}")
-                response = await app.state.chatbot.get_response(
-                    message=request.message,
-                    session_id=request.session_id,
-                    chat_sessions=self.chat_sessions,
-                    metadata=request.metadata
-                )
-                # Put response in queue for main thread
-                self.response_queue.put((request.session_id, response))
-                return ChatResponse(response=response, session_id=request.session_id)
+                logger.info("Received chat request for session %s", request.session_id)
+                with sampled_tracing():
+                    response = await app.state.chatbot.get_response(
+                        message=request.message,
+                        session_id=request.session_id,
+                        chat_sessions=self.chat_sessions,
+                        metadata=request.metadata
+                    )
+                # Summarize turns that fell out of the history window after responding
+                history = self.chat_sessions.local(request.session_id)
+                if history is not None and history.evicted:
+                    background_tasks.add_task(app.state.chatbot.summarize_history, request.session_id, self.chat_sessions)
+                return ORJSONResponse({"response": response, "session_id": request.session_id})
+            except HTTPException:
+                raise
             except Exception as e:
-                logger.error(f"Error in chat endpoint: {str(e)}")
-                logger.error(traceback.format_exc())
+                logger.error("Error in chat endpoint: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
                 raise HTTPException(status_code=500, detail=str(e))
 
+        @app.post("/chat/stream")
+        async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+            """Stream the reply as server-sent events, one JSON-encoded chunk per event"""
+            logger.info("Received streaming chat request for session %s", request.session_id)
+
+            async def events():
+                try:
+                    with sampled_tracing():
+                        async for chunk in app.state.chatbot.stream_response(
+                            message=request.message,
+                            session_id=request.session_id,
+                            chat_sessions=self.chat_sessions,
+                            metadata=request.metadata
+                        ):
+                            yield b"data: " + orjson.dumps(chunk) + b"\n\n"
+                except Exception as e:
+                    # Headers are already sent, so report the failure in-band
+                    logger.error("Error in chat stream: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                    yield b"event: error\ndata: " + orjson.dumps(f"Chat processing error: {str(e)}") + b"\n\n"
+                    return
+                # Background tasks run once the stream has finished
+                history = self.chat_sessions.local(request.session_id)
+                if history is not None and history.evicted:
+                    background_tasks.add_task(app.state.chatbot.summarize_history, request.session_id, self.chat_sessions)
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
         @app.delete("/chat/{session_id}")
-        @traceable(run_type="chain")
         async def clear_chat_history(session_id: str):
             try:
-                if session_id in self.chat_sessions:
-                    self.chat_sessions[session_id].clear()
-                    logger.info(f"Cleared chat history for session {session_id}")
+                if await self.chat_sessions.delete(session_id):
+                    logger.info("Cleared chat history for session %s", session_id)
                     return {"message": f"Chat history cleared for session {session_id}"}
                 raise HTTPException(status_code=404, detail="Session not found")
+            except HTTPException:
+                raise
             except Exception as e:
-                logger.error(f"Error clearing chat history: {str(e)}")
-                logger.error(traceback.format_exc())
+                logger.error("Error clearing chat history: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
                 raise HTTPException(status_code=500, detail=str(e))
 
         @app.get("/health")
@@ -173,14 +583,25 @@ class ChatbotBackend:
             logger.info("Initializing LLM components...")
             app.state.chatbot = await self._initialize_llm()
             logger.info("LLM components initialized successfully")
+            # Warm up in the background so readiness isn't held up by the round trip
+            warm_up = asyncio.create_task(self._warm_up_when_serving(app.state.chatbot))
             yield
+            warm_up.cancel()
         except Exception as e:
-            logger.error(f"Error in lifespan management: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.error("Error in lifespan management: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             raise
         finally:
             logger.info("Cleaning up resources...")
-            self.chat_sessions.clear()
+            await self.chat_sessions.close()
+
+    async def _warm_up_when_serving(self, chatbot: ChatbotState):
+        """Warm up only once uvicorn has bound the port"""
+        # Lifespan startup runs before the bind, so a backend that fails to bind is
+        # shut down (cancelling this task) before any billable call is made. Gunicorn
+        # workers serve an already bound socket and have no in-process server to wait on
+        while self.server is not None and not self.server.started:
+            await asyncio.sleep(0.05)
+        await chatbot.warm_up()
 
     @traceable(run_type="llm_init")
     async def _initialize_llm(self) -> ChatbotState:
@@ -190,62 +611,122 @@ class ChatbotBackend:
             llm = ChatGoogleGenerativeAI(
                 model="gemini-1.5-flash",
                 temperature=0.7,
-                google_api_key=os.getenv("GOOGLE_API_KEY")
+                google_api_key=os.getenv("GOOGLE_API_KEY"),
+                # "rest" or "grpc"; whichever is faster from the deployment region
+                transport=os.getenv("GOOGLE_API_TRANSPORT"),
+                timeout=30
             )
             
             # Create prompt template
             prompt = ChatPromptTemplate.from_messages([
-                ("system", "You are a helpful AI assistant. Respond concisely and naturally."),
+                ("system", "You are a helpful AI assistant. Respond concisely and naturally.{summary}"),
                 MessagesPlaceholder(variable_name="history"),
                 ("human", "{input}")
             ])
             
-            # Create chain
-            chain = prompt | llm
+            # Create chain with history; the getter reads the copy get_response loaded,
+            # and a session deleted mid-call gets a throwaway history instead of coming back
+            chain_with_history = RunnableWithMessageHistory(
+                prompt | llm,
+                lambda sid: self.chat_sessions.local(sid) or CompactChatHistory(),
+                input_messages_key="input",
+                history_messages_key="history"
+            )
+
+            # Summarizes turns that fall out of the history window
+            summary_prompt = ChatPromptTemplate.from_messages([
+                ("system", "Summarize the conversation concisely, keeping any facts the assistant may need later.\n\nCurrent summary: {summary}"),
+                MessagesPlaceholder(variable_name="messages"),
+                ("human", "Write the updated summary.")
+            ])
+            summary_chain = summary_prompt | llm
+
+            # Local embedding model for the semantic response cache, so lookups
+            # don't add a network round trip in front of every LLM call
+            embedding_model = await asyncio.to_thread(
+                SentenceTransformer,
+                os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2"),
+                device="cpu"
+            )
             
             logger.info("LLM initialization completed successfully")
-            return ChatbotState(llm, chain)
+            return ChatbotState(llm, chain_with_history, summary_chain, SemanticCache(embedding_model))
             
         except Exception as e:
-            logger.error(f"Error initializing LLM: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.error("Error initializing LLM: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             raise
 
     def start(self):
-        """Start the backend server in a separate thread"""
+        """Start the backend server in a separate thread, or as Gunicorn workers"""
+        if self.workers > 1:
+            self._start_workers()
+            return
+
         def run_server():
             try:
-                logger.info(f"Starting backend server on port {self.api_port}")
-                asyncio.run(self._run_server())
+                logger.info("Starting backend server on port %s", self.api_port)
+                self.server = self._create_server()
+                # Server.serve() does not install the configured loop itself
+                self.server.config.setup_event_loop()
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+                self.loop.run_until_complete(self._run_server(self.server))
             except Exception as e:
-                logger.error(f"Server error: {str(e)}")
-                logger.error(traceback.format_exc())
+                logger.error("Server error: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
                 raise
+            finally:
+                if self.loop is not None:
+                    self.loop.close()
+                    self.loop = None
 
         self.server_thread = threading.Thread(target=run_server, daemon=True)
         self.server_thread.start()
-        logger.info(f"Backend server started on port {self.api_port}")
+        logger.info("Backend server started on port %s", self.api_port)
 
-    async def _run_server(self):
-        """Run the FastAPI server"""
+    def _start_workers(self):
+        """Serve the app from several Uvicorn worker processes under Gunicorn"""
+        logger.info("Starting %s backend workers on port %s", self.workers, self.api_port)
+        self.server_process = subprocess.Popen(
+            [
+                "gunicorn", "backend:build_app()",
+                "-k", "uvicorn.workers.UvicornWorker",
+                "-w", str(self.workers),
+                "--bind", f"0.0.0.0:{self.api_port}"
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        logger.info("Backend workers started on port %s", self.api_port)
+
+    def _create_server(self) -> uvicorn.Server:
+        """Create the uvicorn server running on uvloop and httptools"""
         config = uvicorn.Config(
             self.app,
             host="0.0.0.0",
             port=self.api_port,
-            log_level="debug"
+            log_level="warning",
+            loop="uvloop",
+            http="httptools",
+            access_log=False
         )
-        server = uvicorn.Server(config)
+        return uvicorn.Server(config)
+
+    async def _run_server(self, server: uvicorn.Server):
+        """Run the FastAPI server"""
         await server.serve()
 
     def stop(self):
         """Stop the backend server"""
+        if self.server_process:
+            self.server_process.terminate()
+            self.server_process.wait()
+            self.server_process = None
+            logger.info("Backend workers stopped")
         if self.server_thread:
+            if self.server is not None:
+                self.server.should_exit = True
             self.server_thread = None
             logger.info("Backend server stopped")
 
-    def get_next_response(self) -> Optional[tuple[str, str]]:
-        """Get the next response from the queue"""
-        try:
-            return self.response_queue.get_nowait()
-        except:
-            return None
\ No newline at end of file
+def build_app() -> FastAPI:
+    """App factory for Gunicorn workers"""
+    return ChatbotBackend().app
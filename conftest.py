@@ -0,0 +1 @@
+# Lets the tests import backend and main from the repository root
@@ -1,13 +1,22 @@
 # main.py
 import os
+import re
+import json
 import streamlit as st
-import threading
 import time
+import atexit
+import asyncio
+import threading
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
 import speech_recognition as sr
 import pyttsx3
-import requests
+import numpy as np
+from faster_whisper import WhisperModel
+import httpx
 from backend import ChatbotBackend
-from langsmith import traceable
+from langsmith import Client, traceable
 import logging
 
 # Configure logging
@@ -17,13 +26,115 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Short timeout so a slow or unreachable LangSmith can't stall the UI
+tracing_client = Client(timeout_ms=1000)
+
+# End of a sentence in streamed text, used to hand completed sentences to TTS
+SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+# The backend answers only after lifespan startup, which loads the embedding model
+# (a download on first run) in-process or in every Gunicorn worker
+BACKEND_STARTUP_TIMEOUT = float(os.getenv("CHATBOT_STARTUP_TIMEOUT", "120"))
+
+@st.cache_resource
+def load_stt_model(name: str) -> Optional[WhisperModel]:
+    """Load the on-device faster-whisper model once per process"""
+    try:
+        model = WhisperModel(name, device="cpu", compute_type="int8")
+        logger.info(f"Loaded faster-whisper model {name}")
+        return model
+    except Exception as e:
+        logger.warning(f"Failed to load faster-whisper model {name}, using Google STT: {e}")
+        return None
+
+class BackendClient:
+    """Keep-alive async HTTP client to the backend, running on its own event loop thread"""
+    def __init__(self, base_url: str):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="backend-client", daemon=True)
+        self.thread.start()
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=4)
+        )
+
+    def submit(self, coro: Awaitable[Any]):
+        """Schedule a coroutine on the client loop and return its concurrent future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        """Run a coroutine on the client loop and wait for its result"""
+        return self.submit(coro).result()
+
+    def close(self):
+        self.run(self.http.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+@st.cache_resource
+def start_backend(workers: int) -> ChatbotBackend:
+    """Start the backend once per process; reruns would otherwise spawn another server each time"""
+    backend = ChatbotBackend(api_port=8000, workers=workers)
+    backend.start()
+    atexit.register(backend.stop)
+    return backend
+
+@st.cache_resource
+def load_backend_client() -> BackendClient:
+    """Create the backend client once per process so its connections are reused across reruns"""
+    client = BackendClient("http://localhost:8000")
+    atexit.register(client.close)
+    return client
+
+@st.cache_resource
+def microphone_calibration() -> Dict[str, Any]:
+    """Ambient-noise calibration shared by every rerun and session in this process"""
+    return {"attempted": False, "energy_threshold": None}
+
+class SpeechPlayer:
+    """Plays text-to-speech on a single worker thread; pyttsx3 engines aren't reentrant"""
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+        # Create the engine on the worker thread that will drive it
+        self.pool.submit(self._init_engine).result()
+
+    def _init_engine(self):
+        self.engine = pyttsx3.init()
+        self.engine.setProperty('rate', 150)
+        self.engine.setProperty('volume', 0.9)
+
+    def say(self, text: str):
+        """Queue text for playback after anything already queued"""
+        self.pool.submit(self._say_blocking, text)
+
+    @traceable(run_type="text_to_speech", client=tracing_client)
+    def _say_blocking(self, text: str):
+        """Convert text to speech and play it"""
+        try:
+            self.engine.say(text)
+            self.engine.runAndWait()
+            logger.info("Text-to-speech completed successfully")
+        except Exception as e:
+            logger.error(f"TTS Error: {e}")
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+@st.cache_resource
+def load_speech_player() -> SpeechPlayer:
+    """Create the TTS player once per process; Streamlit reruns share it"""
+    player = SpeechPlayer()
+    atexit.register(player.close)
+    return player
+
 class IntegratedVoiceChatbot:
     def __init__(self):
         """Initialize the integrated voice chatbot system"""
         self.setup_streamlit()
         self.setup_voice_components()
         self.setup_backend()
-        self.setup_response_thread()
 
     def setup_streamlit(self):
         """Initialize Streamlit UI components and session state"""
@@ -34,17 +145,21 @@ class IntegratedVoiceChatbot:
         if 'system_ready' not in st.session_state:
             st.session_state.system_ready = False
 
-    @traceable(run_type="setup")
     def setup_voice_components(self):
         """Initialize speech recognition and TTS components"""
         try:
             # Initialize speech recognition
             self.recognizer = sr.Recognizer()
+            self.recognizer.dynamic_energy_threshold = True
+            self.calibration = microphone_calibration()
+            if not self.calibration["attempted"]:
+                self.calibrate_microphone()
+            elif self.calibration["energy_threshold"] is not None:
+                self.recognizer.energy_threshold = self.calibration["energy_threshold"]
+            self.stt = load_stt_model(os.getenv("WHISPER_MODEL", "base.en"))
             
-            # Initialize text-to-speech engine
-            self.tts_engine = pyttsx3.init()
-            self.tts_engine.setProperty('rate', 150)
-            self.tts_engine.setProperty('volume', 0.9)
+            # Initialize text-to-speech, shared across reruns so playback stays on one thread
+            self.tts = load_speech_player()
             
             # Session ID for this instance
             self.session_id = "default"
@@ -54,13 +169,14 @@ class IntegratedVoiceChatbot:
             logger.error(f"Failed to initialize voice components: {str(e)}")
             raise
 
-    @traceable(run_type="setup")
     def setup_backend(self):
         """Initialize and start the backend server"""
         try:
-            self.backend = ChatbotBackend(api_port=8000)
-            self.backend.start()
-            time.sleep(2)  # Give the backend server time to start
+            self.backend = start_backend(int(os.getenv("CHATBOT_WORKERS", "1")))
+            # Shared keep-alive client so every turn reuses the same connection to the backend
+            self.client = load_backend_client()
+            with st.spinner("Starting backend..."):
+                self.client.run(self.wait_for_backend())
             st.session_state.system_ready = True
             logger.info("Backend server started successfully")
         except Exception as e:
@@ -68,34 +184,42 @@ class IntegratedVoiceChatbot:
             st.error(f"Failed to start backend server: {str(e)}")
             st.stop()
 
-    def setup_response_thread(self):
-        """Setup thread to check for responses from backend"""
-        def check_responses():
-            while True:
-                response = self.backend.get_next_response()
-                if response:
-                    session_id, message = response
-                    if message:
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": message
-                        })
-                time.sleep(0.1)
-
-        self.response_thread = threading.Thread(target=check_responses, daemon=True)
-        self.response_thread.start()
-        logger.info("Response thread started")
-
-    @traceable(run_type="speech_to_text")
+    async def wait_for_backend(self, timeout: float = BACKEND_STARTUP_TIMEOUT, interval: float = 0.05):
+        """Poll the health endpoint until the backend answers"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if (await self.client.http.get("/health", timeout=interval * 10)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Backend did not become ready within {timeout:.0f}s")
+            await asyncio.sleep(interval)
+
+    def calibrate_microphone(self):
+        """Calibrate the recognizer's energy threshold to ambient noise and remember it for the process"""
+        self.calibration["attempted"] = True
+        try:
+            with sr.Microphone() as source:
+                self.recognizer.adjust_for_ambient_noise(source, duration=1.0)
+            self.calibration["energy_threshold"] = self.recognizer.energy_threshold
+            logger.info(f"Microphone calibrated, energy threshold {self.recognizer.energy_threshold:.1f}")
+        except Exception as e:
+            # Text mode doesn't need a microphone; retry on the first voice turn
+            logger.warning(f"Microphone calibration failed: {e}")
+
+    @traceable(run_type="speech_to_text", client=tracing_client)
     def listen(self) -> str:
         """Listen for voice input and convert it to text"""
+        if self.calibration["energy_threshold"] is None:
+            self.calibrate_microphone()
         with sr.Microphone() as source:
             logger.info("Listening for voice input...")
-            self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
             try:
                 audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=15)
                 logger.info("Processing speech...")
-                text = self.recognizer.recognize_google(audio)
+                text = self.transcribe(audio)
                 logger.info(f"Recognized text: {text}")
                 return text
             except sr.WaitTimeoutError:
@@ -108,35 +232,97 @@ class IntegratedVoiceChatbot:
                 logger.error(f"Speech recognition error: {e}")
                 return ""
 
-    @traceable(run_type="text_to_speech")
+    def transcribe(self, audio: sr.AudioData) -> str:
+        """Transcribe audio on-device with faster-whisper, falling back to Google STT"""
+        if self.stt is not None:
+            try:
+                # 16 kHz mono float32 in [-1, 1], as whisper expects
+                samples = np.frombuffer(audio.get_raw_data(convert_rate=16000, convert_width=2), dtype=np.int16)
+                segments, _ = self.stt.transcribe(
+                    samples.astype(np.float32) / 32768.0,
+                    beam_size=1,
+                    vad_filter=True
+                )
+                # An empty result means the VAD found no speech, not that whisper failed
+                return " ".join(segment.text.strip() for segment in segments).strip()
+            except Exception as e:
+                logger.warning(f"On-device transcription failed, using Google STT: {e}")
+        return self.recognizer.recognize_google(audio)
+
     def speak(self, text: str):
-        """Convert text to speech and play it"""
-        try:
-            self.tts_engine.say(text)
-            self.tts_engine.runAndWait()
-            logger.info("Text-to-speech completed successfully")
-        except Exception as e:
-            logger.error(f"TTS Error: {e}")
+        """Queue text for playback without blocking the UI"""
+        self.tts.say(text)
 
-    @traceable(run_type="chat")
-    def chat(self, message: str) -> str:
-        """Send message to backend and get response"""
+    @traceable(run_type="chat", client=tracing_client)
+    async def chat(self, message: str, input_type: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """Send message to backend, passing streamed chunks to on_chunk, and return the full response"""
+        # Runs on the client loop thread, so it must not touch Streamlit state
         try:
-            response = requests.post(
-                f"http://localhost:8000/chat",
+            chunks = []
+            async with self.client.http.stream(
+                "POST",
+                "/chat/stream",
                 json={
                     "message": message,
- "session_id": self.session_id,
-                    "metadata": {"input_type": "voice" if st.session_state.audio_mode else "text"}
+                    "session_id": self.session_id,
+                    "metadata": {"input_type": input_type}
                 }
-            )
-            response.raise_for_status()
-            return response.json()["response"]
+            ) as response:
+                response.raise_for_status()
+                event = "message"
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "error":
+                            raise RuntimeError(data)
+                        chunks.append(data)
+                        if on_chunk:
+                            on_chunk(data)
+            return "".join(chunks)
         except Exception as e:
             logger.error(f"Chat error: {e}")
             return f"Error communicating with backend: {str(e)}"
 
-    @traceable(run_type="voice_input")
+    def respond(self, message: str) -> str:
+        """Render the exchange, streaming the reply and speaking completed sentences"""
+        speak_aloud = st.session_state.audio_mode
+        with st.chat_message("user"):
+            st.write(message)
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+
+        partial = ""
+        spoken = 0
+
+        with st.spinner("Thinking..."):
+            # The request runs on the client loop thread; chunks are handed back through
+            # a queue so placeholder updates happen on this script thread
+            chunks: Queue = Queue()
+            future = self.client.submit(self.chat(
+                message,
+                input_type="voice" if speak_aloud else "text",
+                on_chunk=chunks.put
+            ))
+            future.add_done_callback(lambda _: chunks.put(None))
+            for chunk in iter(chunks.get, None):
+                partial += chunk
+                placeholder.markdown(partial)
+                if speak_aloud:
+                    ends = [match.end() for match in SENTENCE_END.finditer(partial, spoken)]
+                    if ends:
+                        self.speak(partial[spoken:ends[-1]])
+                        spoken = ends[-1]
+            response = future.result()
+        placeholder.markdown(response)
+        if response and speak_aloud:
+            # On error the response is a message of its own rather than the streamed text
+            rest = response[spoken:] if response == partial else response
+            if rest.strip():
+                self.speak(rest)
+        return response
+
     def handle_voice_input(self):
         """Handle voice input through VoiceChatbot"""
         st.info("🎤 Listening... (Speak now)")
@@ -148,20 +334,17 @@ class IntegratedVoiceChatbot:
                     "content": text
                 })
                 
-                response = self.chat(text)
+                response = self.respond(text)
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": response
                 })
-                if response and st.session_state.audio_mode:
-                    self.speak(response)
                 return True
         except Exception as e:
             logger.error(f"Voice input error: {e}")
             st.error(f"Error processing voice input: {str(e)}")
         return False
 
-    @traceable(run_type="text_input")
     def handle_text_input(self, text: str):
         """Handle text input through both systems"""
         try:
@@ -170,30 +353,26 @@ class IntegratedVoiceChatbot:
                 "content": text
             })
             
-            response = self.chat(text)
+            response = self.respond(text)
             st.session_state.messages.append({
                 "role": "assistant",
                 "content": response
             })
-            if response and st.session_state.audio_mode:
-                self.speak(response)
-                
+
         except Exception as e:
             logger.error(f"Text input error: {e}")
             st.error(f"Error processing text input: {str(e)}")
 
-    @traceable(run_type="clear")
     def clear_history(self):
         """Clear chat history in both systems"""
         try:
-            requests.delete(f"http://localhost:8000/chat/{self.session_id}")
+            self.client.run(self.client.http.delete(f"/chat/{self.session_id}"))
             st.session_state.messages = []
             logger.info("Chat history cleared successfully")
         except Exception as e:
             logger.error(f"Error clearing history: {e}")
             st.error(f"Error clearing history: {str(e)}")
 
-    @traceable(run_type="render")
     def render(self):
         """Render the Streamlit UI"""
         st.title("🎙️ Chatbot")
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+
+import numpy as np
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from backend import ChatbotState, CompactChatHistory, SemanticCache, SessionStore
+
+class HashEncoder:
+    """Stands in for SentenceTransformer: equal normalized prompts get equal unit vectors"""
+    def get_sentence_embedding_dimension(self) -> int:
+        return 32
+
+    def encode(self, text: str, normalize_embeddings: bool = False) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=4).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(32)
+        return vector / np.linalg.norm(vector)
+
+def make_chatbot(responses):
+    sessions = SessionStore()
+    llm = FakeListChatModel(responses=responses)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful AI assistant.{summary}"),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}")
+    ])
+    chain_with_history = RunnableWithMessageHistory(
+        prompt | llm,
+        lambda sid: sessions.local(sid) or CompactChatHistory(),
+        input_messages_key="input",
+        history_messages_key="history"
+    )
+    return ChatbotState(llm, chain_with_history, None, SemanticCache(HashEncoder())), sessions
+
+def test_opening_prompt_is_served_from_cache_in_another_session():
+    chatbot, sessions = make_chatbot(["Hi! How can I help?", "Called the LLM again"])
+
+    async def scenario():
+        first = await chatbot.get_response("Hello there", "a", sessions)
+        second = await chatbot.get_response("hello   THERE", "b", sessions)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == "Hi! How can I help?"
+    assert second == first
+    # The cached turn is still recorded so the conversation continues from it
+    assert sessions.local("b").contents == ["hello   THERE", first]
+
+def test_follow_up_prompts_always_reach_the_llm():
+    chatbot, sessions = make_chatbot(["Hi! How can I help?", "Still here."])
+
+    async def scenario():
+        await chatbot.get_response("Hello there", "a", sessions)
+        return await chatbot.get_response("Hello there", "a", sessions)
+
+    assert asyncio.run(scenario()) == "Still here."
+
+def test_stream_serves_cached_opening_reply():
+    chatbot, sessions = make_chatbot(["Hi! How can I help?", "Called the LLM again"])
+
+    async def scenario():
+        await chatbot.get_response("Hello there", "a", sessions)
+        return [chunk async for chunk in chatbot.stream_response("Hello there", "b", sessions)]
+
+    assert asyncio.run(scenario()) == ["Hi! How can I help?"]
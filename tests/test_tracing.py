@@ -0,0 +1,24 @@
+import pytest
+from langchain_core.tracers.context import _tracing_v2_is_enabled
+from langsmith import utils as ls_utils
+
+import backend
+
+@pytest.fixture
+def tracing_on(monkeypatch):
+    monkeypatch.setenv("LANGCHAIN_TRACING_V2", "true")
+    # langsmith caches environment lookups
+    ls_utils.get_env_var.cache_clear()
+    yield
+    ls_utils.get_env_var.cache_clear()
+
+def test_unsampled_requests_turn_tracing_off(tracing_on, monkeypatch):
+    monkeypatch.setattr(backend, "TRACE_SAMPLE_RATE", 0.0)
+    assert _tracing_v2_is_enabled()
+    with backend.sampled_tracing():
+        assert not _tracing_v2_is_enabled()
+
+def test_sampled_requests_keep_configured_tracing(tracing_on, monkeypatch):
+    monkeypatch.setattr(backend, "TRACE_SAMPLE_RATE", 1.0)
+    with backend.sampled_tracing():
+        assert _tracing_v2_is_enabled()